@@ -1,16 +1,81 @@
 import argparse
+import csv
+import io
 import json
+import os
 import re
-import pandas as pd
+import shutil
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from email.utils import formatdate
+from functools import lru_cache
 from urllib.parse import urlparse
 
 
-def nextLine(lines, i):
-    next_line = lines[i + 1]
-    while len(next_line.split(' ', 1)) != 2:
-        i += 1
-        next_line = lines[i + 1]
-    return next_line
+# Buffer size for reading and writing the datasets, much larger than the 8 KiB default
+IO_BUFFER_SIZE = 1 << 20
+
+# Tags that continue an entity started by a B tag
+CONTINUATION_TAGS = frozenset(['I', 'E'])
+
+
+def parse_lines(lines):
+    # Split every line once into (word, bio, entity); None for lines with no entity label
+    parsed_lines = []
+    for line in lines:
+        word, separator, label = line.partition(' ')
+        if separator:
+            parsed_lines.append((word, label[:1], label[2:]))
+        else:
+            parsed_lines.append(None)
+    return parsed_lines
+
+
+def next_valid_lines(parsed_lines):
+    # For each index, the next parsed line that has an entity label (None at the end), in one backward pass
+    next_lines = [None] * len(parsed_lines)
+    next_line = None
+    for i in range(len(parsed_lines) - 1, -1, -1):
+        next_lines[i] = next_line
+        if parsed_lines[i] is not None:
+            next_line = parsed_lines[i]
+    return next_lines
+
+
+def next_valid_indices(parsed_lines):
+    # For each index, the index of the next line that has an entity label (None at the end), so that
+    # multi-token walks can jump from one labelled line to the next
+    next_indices = [None] * len(parsed_lines)
+    next_index = None
+    for i in range(len(parsed_lines) - 1, -1, -1):
+        next_indices[i] = next_index
+        if parsed_lines[i] is not None:
+            next_index = i
+    return next_indices
+
+
+# Age in seconds after which createTables downloads the MITRE tables again
+TABLES_MAX_AGE = 24 * 60 * 60
+
+
+def fetch_tables(name, url):
+    # Conditional GET against the table written last time: None when the page has not changed since,
+    # so the page is neither downloaded nor parsed again
+    request = urllib.request.Request(url)
+    if os.path.exists(name):
+        request.add_header('If-Modified-Since', formatdate(os.path.getmtime(name), usegmt=True))
+    try:
+        with urllib.request.urlopen(request) as response:
+            html = response.read().decode(response.headers.get_content_charset() or 'utf-8')
+    except urllib.error.HTTPError as error:
+        if error.code == 304:
+            return None
+        raise
+    # pandas is only needed to parse the pages; imported here so spawned dataset workers do not load it
+    import pandas as pd
+    return pd.read_html(io.StringIO(html))
 
 
 def createTables():
@@ -18,12 +83,28 @@ def createTables():
     grp_url = 'http://attack.mitre.org/groups/'
     names = ['mitre_attack_software.csv', 'mitre_attack_group.csv']
     urls = [soft_url, grp_url]
-    for i, url in enumerate(urls):
-        tables = pd.read_html(url)
-        if tables:
+    # The MITRE pages rarely change: keep tables fetched less than TABLES_MAX_AGE seconds ago
+    stale = []
+    for name, url in zip(names, urls):
+        if os.path.exists(name) and time.time() - os.path.getmtime(name) < TABLES_MAX_AGE:
+            print(f"{name} table is up to date.")
+        else:
+            stale.append((name, url))
+    if not stale:
+        return
+
+    # The pages are independent, fetch them concurrently
+    with ThreadPoolExecutor(max_workers=len(stale)) as executor:
+        all_tables = list(executor.map(fetch_tables, *zip(*stale)))
+    for (name, url), tables in zip(stale, all_tables):
+        if tables is None:
+            # Unchanged page: the table counts as fresh again for TABLES_MAX_AGE
+            os.utime(name)
+            print(f"{name} table is up to date.")
+        elif tables:
             table1 = tables[0]
-            table1.to_csv(names[i], index=False)
-            print(f"{names[i]} table created successfully.")
+            table1.to_csv(name, index=False)
+            print(f"{name} table created successfully.")
         else:
             print("No tables found on the page.")
 
@@ -31,20 +112,25 @@ def createTables():
 def convert_to_bio(annotated_text):
     lines = annotated_text.strip().split('\n')
     bio_lines = []
+    bio_labels = {}
     k = 0
     for i, line in enumerate(lines):
-        parts = line.split(" ", 1)
-        if len(parts) == 2:
-            word, label = parts
-            label = label.strip()
-
-            bio, entity = label[0], label[2:]
-            if bio == 'E':
-                bio_lines.append(f"{word} I-{entity}")
-            elif bio == 'S':
-                bio_lines.append(f"{word} B-{entity}")
-            else:
-                bio_lines.append(f"{word} {label}")
+        word, separator, label = line.partition(" ")
+        if separator:
+            # a dataset only has a handful of distinct labels, convert each of them once
+            bio_label = bio_labels.get(label)
+            if bio_label is None:
+                stripped_label = label.strip()
+                bio, entity = stripped_label[0], stripped_label[2:]
+                if bio == 'E':
+                    bio_label = f"I-{entity}"
+                elif bio == 'S':
+                    bio_label = f"B-{entity}"
+                else:
+                    bio_label = stripped_label
+                bio_labels[label] = bio_label
+            # B, I and O lines usually come out as they went in
+            bio_lines.append(line if bio_label == label else f"{word} {bio_label}")
         else:
             bio_lines.append(line)  # For lines with no entity label
             k += 1
@@ -53,33 +139,25 @@ def convert_to_bio(annotated_text):
     return '\n'.join(bio_lines)
 
 
+# BIO -> BIOES transitions, keyed on (tag, whether the next labelled token is an I tag)
+BIOES_TAGS = {('B', True): 'B', ('B', False): 'S', ('I', True): 'I', ('I', False): 'E'}
+
+
 def convert_to_bioes(annotated_text):
     lines = annotated_text.strip().split('\n')
+    parsed_lines = parse_lines(lines)
     bioes_lines = []
 
-    for i, line in enumerate(lines):
-        parts = line.split(" ", 1)
-        if len(parts) == 2:
-            word, label = parts
-            bio, entity = label[0], label[2:]
+    for line, parsed, next_parsed in zip(lines, parsed_lines, next_valid_lines(parsed_lines)):
+        if parsed is not None:
+            word, bio, entity = parsed
             if bio == 'O':
-                bioes_lines.append(f"{word} O")
-            elif bio == 'B':
-                next_line = nextLine(lines, i)
-                next_word, next_label = next_line.split(' ', 1)
-                next_bio, next_entity = next_label[0], next_label[2:]
-                if next_bio == 'I':
-                    bioes_lines.append(f"{word} B-{entity}")
-                else:
-                    bioes_lines.append(f"{word} S-{entity}")
-            elif bio == 'I':
-                next_line = nextLine(lines, i)
-                next_word, next_label = next_line.split(' ', 1)
-                next_bio, next_entity = next_label[0], next_label[2:]
-                if next_bio == 'I':
-                    bioes_lines.append(f"{word} I-{entity}")
-                else:
-                    bioes_lines.append(f"{word} E-{entity}")
+                # Reuse the line when its label is exactly O
+                bioes_lines.append(line if len(line) == len(word) + 2 else f"{word} O")
+            else:
+                tag = BIOES_TAGS.get((bio, next_parsed is not None and next_parsed[1] == 'I'))
+                if tag:
+                    bioes_lines.append(f"{word} {tag}-{entity}")
         else:
             bioes_lines.append(line)  # For lines with no entity label
 
@@ -101,30 +179,72 @@ def detect_format(annotated_text):
     return 'BIO'
 
 
-def perform_1to1_mapping(dataset_content, source_labels, target_labels):
-    lines = dataset_content.strip().split('\n')
-    updated_lines = []
+def transform_lines(text, line_transform, *transform_args):
+    # Apply a line by line transform, a generator over the lines, to a whole dataset
+    return '\n'.join(line_transform(text.strip().split('\n'), *transform_args))
+
+
+def run_on_datasets(annotated_texts, jobs):
+    # jobs are (dataset_number, transform, transform_args) where transform(text, *transform_args) returns the new
+    # text of that dataset. The datasets are independent: two jobs run side by side in worker processes
+    annotated_texts = list(annotated_texts)
+    if len(jobs) < 2:
+        for dataset_number, transform, transform_args in jobs:
+            annotated_texts[dataset_number - 1] = transform(annotated_texts[dataset_number - 1], *transform_args)
+    else:
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            futures = [(dataset_number, executor.submit(transform, annotated_texts[dataset_number - 1], *transform_args))
+                       for dataset_number, transform, transform_args in jobs]
+            for dataset_number, future in futures:
+                annotated_texts[dataset_number - 1] = future.result()
+    return annotated_texts
+
+
+def run_pipeline(annotated_text, steps):
+    # Apply the (transform, transform_args) steps planned for one dataset, in order
+    for transform, transform_args in steps:
+        annotated_text = transform(annotated_text, *transform_args)
+    return annotated_text
+
 
+def map_entity_labels(lines, target_by_label):
+    # label -> mapped label ('' when unmapped), built once per distinct label
+    mapped_labels = {}
     for line in lines:
-        parts = line.split(" ", 1)
-        if len(parts) == 2:
-            word, label = parts
-            bio, entity = label[0], label[2:]
+        word, sep, label = line.partition(" ")
+        if sep:
+            mapped_label = mapped_labels.get(label)
+            if mapped_label is None:
+                entity = label[2:]
+                if entity in target_by_label:
+                    mapped_label = f"{label[0]}-{target_by_label[entity]}"
+                else:
+                    mapped_label = ''
+                mapped_labels[label] = mapped_label
 
-            # if entity in source_labels:
-            if source_labels and entity in source_labels:  # do not attempt to index NA
-                updated_lines.append(f"{word} {bio}-{target_labels[source_labels.index(entity)]}")
-            else:
-                updated_lines.append(line)
-        else:
-            updated_lines.append(line)  # For lines with no entity label
+            if mapped_label:
+                yield f"{word} {mapped_label}"
+                continue
+        yield line  # unmapped, or no entity label
+
+
+def one_to_one_targets(source_labels, target_labels):
+    # source -> target label; the first occurrence wins, as with list.index
+    target_by_label = {}
+    if source_labels:  # NA gives no mapping
+        for source_label, target_label in zip(source_labels, target_labels):
+            target_by_label.setdefault(source_label, target_label)
+    return target_by_label
 
-    return '\n'.join(updated_lines)
+
+def perform_1to1_mapping(dataset_content, source_labels, target_labels):
+    lines = dataset_content.strip().split('\n')
+    return '\n'.join(map_entity_labels(lines, one_to_one_targets(source_labels, target_labels)))
 
 
 def prompt_user_for_labels(dataset_number):
     # print(f"Enter the labels for Dataset {dataset_number}:")
-    labels = input(f"Dataset {dataset_number} eg. APT,LOC,TIME, or NA for not applicable: ").strip()
+    labels = ask(f"Dataset {dataset_number} eg. APT,LOC,TIME, or NA for not applicable: ").strip()
     if labels.lower() == 'na':
         return None
     else:
@@ -133,40 +253,30 @@ def prompt_user_for_labels(dataset_number):
 
 def prompt_user_for_labels_manyTo1(dataset_number):
     # print(f"Dataset {dataset_number} labels for Many-to-1 mappings")
-    labels = input(f"Dataset {dataset_number}: ").strip()
+    labels = ask(f"Dataset {dataset_number}: ").strip()
     if labels.lower() == 'na':
         return None
     else:
         return [label_set.strip() for label_set in labels.split(';')]
 
 
-def perform_many_to_1_mapping(dataset_content, many_labels_sets, target_labels):
-    lines = dataset_content.strip().split('\n')
-    updated_lines = []
+def all_na(*label_lists):
+    # True when every label list was skipped (None) or only holds NA entries
+    return all(labels is None or all(label.lower() == 'na' for label in labels) for labels in label_lists)
 
-    for line in lines:
-        parts = line.split(" ", 1)
-        if len(parts) == 2:
-            word, label = parts
-            bio, entity = label[0], label[2:]
-
-            # Initialize a flag to check if the entity was found in any label set
-            entity_found = False
-
-            for many_labels_set in many_labels_sets:
-                many_labels = many_labels_set.split(',')
-                if entity in many_labels:
-                    updated_lines.append(f"{word} {bio}-{target_labels[many_labels_sets.index(many_labels_set)]}")
-                    entity_found = True
-                    break  # Entity found, no need to check other label sets
-
-            # If the entity was not found in any label set, append the original line
-            if not entity_found:
-                updated_lines.append(line)
-        else:
-            updated_lines.append(line)  # For lines with no entity label
 
-    return '\n'.join(updated_lines)
+def many_to_one_targets(many_labels_sets, target_labels):
+    # Flatten the label sets once; the first set containing an entity wins
+    target_by_label = {}
+    for many_labels_set, target_label in zip(many_labels_sets, target_labels):
+        for many_label in many_labels_set.split(','):
+            target_by_label.setdefault(many_label, target_label)
+    return target_by_label
+
+
+def perform_many_to_1_mapping(dataset_content, many_labels_sets, target_labels):
+    lines = dataset_content.strip().split('\n')
+    return '\n'.join(map_entity_labels(lines, many_to_one_targets(many_labels_sets, target_labels)))
 
 
 def oneTo1Mappings(args):
@@ -193,10 +303,10 @@ def oneTo1Mappings(args):
         print("Targets labels for 1to1 mappings comma-separated (eg Area,HackOrg)")
         labels_target_dataset2 = prompt_user_for_labels(2)
 
+    jobs = []
+    done_messages = []
     # Check if all label sets are "NA" and skip the function
-    if all(label is None or (isinstance(label, list) and all(l.lower() == 'na' for l in label)) for
-           label in
-           [labels_dataset1, labels_target_dataset1, labels_dataset2, labels_target_dataset2]):
+    if all_na(labels_dataset1, labels_target_dataset1, labels_dataset2, labels_target_dataset2):
         print("No 1-to-1 mapping is required. Exiting.")
     else:
         # Check if the lengths of the label lists are the same
@@ -216,48 +326,15 @@ def oneTo1Mappings(args):
             with open(labels_filename, 'w', encoding='utf-8') as labels_file:
                 json.dump(labels_info, labels_file)
 
-            # Use a different variable name (not args) for the Namespace object
-            labels_args = argparse.Namespace(
-                labels_file=labels_filename,
-                input_file_1=args.input_file_1,  # The user will provide the path as a command-line argument
-                input_file_2=args.input_file_2
-            )
-
-            # # Get the input file paths from the command-line arguments
-            # parser = argparse.ArgumentParser(description='Convert BIO to BIOES format')
-            # parser.add_argument('format_choice', choices=['BIO', 'BIOES'], help='Output format choice')
-            # parser.add_argument('input_file_1', help='Path to the first input file')
-            # parser.add_argument('input_file_2', help='Path to the second input file')
-            # parser.add_argument('merged_output_file', help='Path to the merged output file')
-            # args = parser.parse_args(namespace=labels_args)
-
-            if apply_to_dataset1:
-                with open(labels_args.input_file_1, 'r+', encoding='utf-8') as f1:
-                    dataset1_content = f1.read()
-                    # print("Original content of Dataset 1:")
-                    # print(dataset1_content)
-
-                    if labels_dataset1 and labels_target_dataset1:
-                        updated_dataset1 = perform_1to1_mapping(dataset1_content, labels_dataset1,
-                                                                labels_target_dataset1)
-                        # print("Updated content of Dataset 1:")
-                        # print(updated_dataset1)
-
-                        with open(labels_args.input_file_1, 'w', encoding='utf-8') as f1_write:
-                            f1_write.write(updated_dataset1)
-                            print("Dataset 1 completed.\n")
-
-            if apply_to_dataset2:
-                with open(labels_args.input_file_2, 'r+', encoding='utf-8') as f2:
-                    dataset2_content = f2.read()
-                    if labels_dataset2 and labels_target_dataset2:
-                        updated_dataset2 = perform_1to1_mapping(dataset2_content, labels_dataset2,
-                                                                labels_target_dataset2)
-                        with open(labels_args.input_file_2, 'w', encoding='utf-8') as f2_write:
-                            f2_write.write(updated_dataset2)
-                            print("Dataset 2 completed.\n")
-
-            print("oneTo1Mappings completed.\n")
+            if apply_to_dataset1 and labels_dataset1 and labels_target_dataset1:
+                jobs.append((1, perform_1to1_mapping, (labels_dataset1, labels_target_dataset1)))
+                done_messages.append("Dataset 1 completed.\n")
+            if apply_to_dataset2 and labels_dataset2 and labels_target_dataset2:
+                jobs.append((2, perform_1to1_mapping, (labels_dataset2, labels_target_dataset2)))
+                done_messages.append("Dataset 2 completed.\n")
+            done_messages.append("oneTo1Mappings completed.\n")
+
+    return jobs, done_messages
 
 
 def manyTo1Mappings(args):
@@ -283,10 +360,10 @@ def manyTo1Mappings(args):
         print("Target labels for manyto1 mappings: eg. IDTY;ACT ")
         many_labels_target_dataset2 = prompt_user_for_labels_manyTo1(2)
 
+    jobs = []
+    done_messages = []
     # Check if all label sets are "NA" and skip the function
-    if all(label_set is None or (isinstance(label_set, list) and all(l.lower() == 'na' for l in label_set)) for
-           label_set in
-           [many_labels_dataset1, many_labels_target_dataset1, many_labels_dataset2, many_labels_target_dataset2]):
+    if all_na(many_labels_dataset1, many_labels_target_dataset1, many_labels_dataset2, many_labels_target_dataset2):
         print("Skipping Many-to-1 mapping as all labels are 'NA'.")
     else:
         many_labels_info = {
@@ -299,79 +376,68 @@ def manyTo1Mappings(args):
         with open(many_labels_filename, 'w', encoding='utf-8') as many_labels_file:
             json.dump(many_labels_info, many_labels_file)
 
-        many_labels_args = argparse.Namespace(
-            labels_file=many_labels_filename,
-            input_file_1=args.input_file_1,
-            input_file_2=args.input_file_2
-        )
-
-        content = many_labels_args.input_file_1
-        # print("before reading", content)
-        if apply_to_dataset1:
-            with open(many_labels_args.input_file_1, 'r', encoding='utf-8') as f1:
-                dataset1_content = f1.read()
-                # print("Original content of Dataset 1:")
-                # print(dataset1_content)
-
-                if many_labels_dataset1 and many_labels_target_dataset1:
-                    updated_dataset1 = perform_many_to_1_mapping(dataset1_content, many_labels_dataset1,
-                                                                 many_labels_target_dataset1)
-                    # print("Updated content of Dataset 1:")
-                    # print(updated_dataset1)
-
-                    with open(many_labels_args.input_file_1, 'w', encoding='utf-8') as f1_write:
-                        f1_write.write(updated_dataset1)
-                        print(" Dataset 1 completed. \n")
-
-        if apply_to_dataset2:
-            with open(many_labels_args.input_file_2, 'r', encoding='utf-8') as f2:
-                dataset2_content = f2.read()
-                if many_labels_dataset2 and many_labels_target_dataset2:
-                    updated_dataset2 = perform_many_to_1_mapping(dataset2_content, many_labels_dataset2,
-                                                                 many_labels_target_dataset2)
-                    with open(many_labels_args.input_file_2, 'w', encoding='utf-8') as f2_write:
-                        f2_write.write(updated_dataset2)
-                        print(" Dataset 2 completed. \n ")
-
-        print("manyTo1Mappings completed.\n")
+        if apply_to_dataset1 and many_labels_dataset1 and many_labels_target_dataset1:
+            jobs.append((1, perform_many_to_1_mapping, (many_labels_dataset1, many_labels_target_dataset1)))
+            done_messages.append(" Dataset 1 completed. \n")
+        if apply_to_dataset2 and many_labels_dataset2 and many_labels_target_dataset2:
+            jobs.append((2, perform_many_to_1_mapping, (many_labels_dataset2, many_labels_target_dataset2)))
+            done_messages.append(" Dataset 2 completed. \n ")
+        done_messages.append("manyTo1Mappings completed.\n")
+
+    return jobs, done_messages
 
 
 # ============================ 1-to-many mappings =============================
-def isFile(text):
-    # Define a regular expression pattern to exclude domains
-    exclude_domains_pattern = r'\.(com|net|org|gov|edu|fr)\b'
-    cleaned_text = re.sub(r'[^\w\s.]+', '', text)
+# Pattern used per token by isFile, compiled once at import
+CLEAN_PATTERN = re.compile(r'[^\w\s.]+')
+
+# File extensions, and domain suffixes that are never treated as files
+FILE_EXTENSIONS = frozenset([
+    'jpg', 'gif', 'doc', 'pdf', 'exe', 'docx', 'sh', 'zip', 'tar', 'mp3', 'mp4', 'txt', 'dat', 'bash', 'dll', 'net',
+    'json', 'dcm', 'js', 'java', 'py', 'php', 'html', 'css', 'mov', 'wav', 'xsl', 'eps', 'avi', 'ppt', 'xlsx', 'odt',
+    'mid', 'mpa', 'wma', 'aif', 'rar', 'gz', '7z', 'arj', 'pkg', 'rpm', 'wpl', 'csv', 'xml', 'sql', 'ps', 'jps', 'cer',
+    'pfx', 'jsp', 'xhtml', 'rss', 'pptx', 'png', 'jpeg', 'md', 'bak'])
+EXCLUDED_DOMAINS = frozenset(['com', 'net', 'org', 'gov', 'edu', 'fr'])
+
+# Hash algorithm by hex digest length
+HASH_ALGORITHMS = {32: 'MD5', 40: 'SHA1', 64: 'SHA2', 128: 'SHA3'}
+HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
+# Punctuation that may surround a hash in running text; characters inside the token are kept
+HASH_PUNCTUATION = '()[]{}<>.,;:\'"“”'
 
-    # Compile the exclusion pattern
-    # exclude_domains_regex = re.compile(exclude_domains_pattern, re.IGNORECASE)
 
-    # Define a regular expression pattern to match file extensions file_extension_pattern = r'\.(
-    file_extension_pattern = r'\.(jpg|gif|doc|pdf|exe|docx|sh|zip|tar|mp3|mp4|txt|dat|bash|dll|net|json|dcm|js|java' \
-                             r'|py|php|html|css|mov|wav|xsl|eps|avi|ppt|xlsx|odt|mid|mpa|wma|aif|rar|gz|7z|arj|pkg' \
-                             r'|rpm|wpl|csv|xml|sql|ps|jps|cer|pfx|jsp|xhtml|rss|pptx|png|jpeg|md|bak|)$'
-    # Combine the exclusion pattern and file extension pattern
-    combined_pattern = re.compile(fr'^.*{file_extension_pattern}(?!.*{exclude_domains_pattern})', re.IGNORECASE)
+def isFile(text):
+    # Cleaning never adds a dot, so a token without one cannot have an extension
+    if '.' not in text:
+        return None
+    # Trailing dots are sentence punctuation (x.exe.), not an empty extension
+    cleaned_text = CLEAN_PATTERN.sub('', text).rstrip('.')
+    # the extension is whatever follows the last dot
+    name, dot, extension = cleaned_text.rpartition('.')
+    extension = extension.lower()
 
-    if combined_pattern.match(cleaned_text):
+    if dot and extension in FILE_EXTENSIONS and extension not in EXCLUDED_DOMAINS:
         return 'FILE'
     else:
         return None
 
 
 def isHash(text):
-    # Define a regular expression pattern for various hash algorithms
-    hash_pattern = r'\b(?:[a-fA-F0-9]{32}|[a-fA-F0-9]{40}|[a-fA-F0-9]{64}|[a-fA-F0-9]{128})\b'
-    cleaned_text = re.sub(r'[^\w\s.]+', '', text)
-    # Example usage:
-    matches = re.findall(hash_pattern, cleaned_text)
-
-    if matches:
-        return text
+    # Returns the hex digest (the token without surrounding punctuation) when the token is a hash,
+    # so a GUID keeps its dashes and is not taken for one
+    if len(text) < 32:
+        return None
+    cleaned_text = text.strip(HASH_PUNCTUATION)
+
+    if len(cleaned_text) in HASH_ALGORITHMS and HEX_DIGITS.issuperset(cleaned_text):
+        return cleaned_text
     else:
         return None
 
 
+@lru_cache(maxsize=None)
 def sampleFile(entity, default_label):
+    # Cached: file and hash tokens repeat a lot across a dataset
     file_type = isFile(entity)
     if file_type:
         return file_type
@@ -379,17 +445,8 @@ def sampleFile(entity, default_label):
         hash_value = isHash(entity)
 
         if hash_value:
-            # Check hash length to determine the algorithm
-            if len(hash_value) <= 32:
-                return "MD5"
-            elif len(hash_value) <= 40:
-                return "SHA1"
-            elif len(hash_value) <= 64:
-                return "SHA2"
-            elif len(hash_value) <= 128:
-                return "SHA3"
-            else:
-                return "SHA3"
+            # The digest length determines the algorithm
+            return HASH_ALGORITHMS[len(hash_value)]
         else:
             return default_label  # default value
 
@@ -403,14 +460,26 @@ def transform_output(entity, software_type, entity_labels):
     return "\n".join(transformed_output)
 
 
+@lru_cache(maxsize=None)
+def load_software_types():
+    # lowercased software name -> TYPE, read once per run; the first row wins on duplicates
+    file_path = "mitre_software.csv"
+    software_types = {}
+    with open(file_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if row['NAME']:
+                software_types.setdefault(row['NAME'].lower(), row['TYPE'])
+    return software_types
+
+
+@lru_cache(maxsize=None)
 def get_type_by_name(name, default_label, new_label):
+    # new_label must be a tuple (TOOL label, MALWARE label) so that results can be cached
     name = name.lower()
-    file_path = "mitre_software.csv"
-    df = pd.read_csv(file_path)
+    software_types = load_software_types()
 
-    row = df[df['NAME'].str.lower() == name]
-    if not row.empty:
-        if row['TYPE'].values[0] == 'TOOL':
+    if name in software_types:
+        if software_types[name] == 'TOOL':
             return new_label[0]
         else:
             return new_label[1]
@@ -418,36 +487,35 @@ def get_type_by_name(name, default_label, new_label):
         return default_label
 
 
-def nextLine(lines, i):
-    while i + 1 < len(lines):
-        next_line = lines[i + 1]
-        if len(next_line.split(' ', 1)) == 2:
-            return next_line
-        i += 1
-    return None
-
-
-def classify_file(text, dataset_number):
-    lines = text.strip().split("\n")
-    dataset_label = input(
+def prompt_file_labels(dataset_number):
+    # Returns None when the user skips the classification, so the dataset is not even read
+    dataset_label = ask(
         f"Dataset {dataset_number}, enter the file labels for entities to be classified (e.g., FILE/File): ").strip()
-    default_label = input(
+    default_label = ask(
         f"Dataset {dataset_number}, enter the default label (e.g., FILE/MAL): ").strip()
 
+    if dataset_label.lower() == 'na' or default_label.lower() == 'na':
+        print("Skipping as the file label or default label is NA")
+        return None
+    return dataset_label, default_label
+
+
+def classify_file(text, dataset_label, default_label):
+    lines = text.strip().split("\n")
+    parsed_lines = parse_lines(lines)
+    next_lines = next_valid_lines(parsed_lines)
     updated_dataset = []
     for i, line in enumerate(lines):
         # print("initial here", line)
         if line.split():
-            parts = line.split(" ", 1)
-            if len(parts) == 2:
-                word, label = parts
-                if label[2:] == dataset_label and label[0] == 'S':
+            if parsed_lines[i] is not None:
+                word, bio, entity = parsed_lines[i]
+                if entity == dataset_label and bio == 'S':
                     new_label = sampleFile(word, default_label)
                     updated_dataset.append(f"{word} S-{new_label}")
-                elif label[2:] == dataset_label and label[0] == 'B':
-                    next_line = nextLine(lines, i)
-                    next_word, next_label = next_line.split(' ', 1)
-                    if next_label[0] != 'I' and next_label[0] != 'E':
+                elif entity == dataset_label and bio == 'B':
+                    next_line = next_lines[i]
+                    if next_line is None or next_line[1] not in CONTINUATION_TAGS:
                         new_label = sampleFile(word, default_label)
                         updated_dataset.append(f"{word} B-{new_label}")
 
@@ -461,391 +529,387 @@ def classify_file(text, dataset_number):
     return '\n'.join(updated_dataset)
 
 
-def classify_exploit(text, dataset_number):
+def prompt_exploit_labels(dataset_number):
+    # Returns None when the user skips the classification
     print(f"For the dataset {dataset_number}")
-    dataset_label = input("Enter the dataset exploit label to be classified eg. Exp: ")
-    targetLabels = input("Enter the traget labels for the exploit name and ID, (eg. VULNAME,VULID) in the same order: ")
+    dataset_label = ask("Enter the dataset exploit label to be classified eg. Exp: ")
+    targetLabels = ask("Enter the traget labels for the exploit name and ID, (eg. VULNAME,VULID) in the same order: ")
 
     target_labels = targetLabels.split(',')
     if all(l.lower() == 'na' for l in target_labels) or dataset_label == 'na':
         print("Skipping as all target labels are NA or dataset label is NA")
-        return text
+        return None
+    return dataset_label, target_labels
 
+
+def classify_exploit(text, dataset_label, target_labels):
     lines = text.strip().split("\n")
     updated_dataset = []
     for i, line in enumerate(lines):
         # print("initial here", line)
         if line.split():
-            parts = line.split(" ", 1)
-            if len(parts) == 2:
-                word, label = parts
+            word, separator, label = line.partition(" ")
+            if separator:
                 if label[2:].upper() == dataset_label.upper():
-                    if word.startswith("CVE") or word.startswith("(CVE"):
+                    if word.startswith(("CVE", "(CVE")):
                         label = label.replace(label[2:], target_labels[1])
                     else:
                         label = label.replace(label[2:], target_labels[0])
                     updated_dataset.append(f"{word} {label}")
 
                 else:
-                    updated_dataset.append(f"{word} {label}")
+                    updated_dataset.append(line)
             else:
                 updated_dataset.append(line)
 
     return '\n'.join(updated_dataset)
 
 
+@lru_cache(maxsize=None)
+def load_group_names():
+    # lowercased ATT&CK group names, read once per run
+    file_path = "mitre_attack_group.csv"
+    with open(file_path, newline='', encoding='utf-8') as f:
+        return frozenset(row['Name'].lower() for row in csv.DictReader(f) if row['Name'])
+
+
+@lru_cache(maxsize=None)
 def get_group_by_name(name, default_label, new_label):
     name = name.lower()
-    file_path = "mitre_attack_group.csv"
-    df = pd.read_csv(file_path)
 
-    row = df[df['Name'].str.lower() == name]
-    if not row.empty:
+    if name in load_group_names():
         return new_label
     else:
         return default_label
 
 
-def software_label_update(text, dataset_number):
-    # print("---------------ATT&CK Software Classification------------------\n")
-    lines = text.strip().split("\n")
-    dataset_labels = input(
+def prompt_software_labels(dataset_number):
+    # Returns None when the user skips the classification
+    dataset_labels = ask(
         f"Dataset {dataset_number}, enter labels for software entities to be classified with Mitre platform (e.g., "
         f"TOOL) comma-separated if many or NA to skip: ").strip()
     # dataset_label = 'TOOL'
     # Check if all dataset labels are "NA" and skip the function
     if all(label.lower() == 'na' for label in dataset_labels.split(',')):
         print("Skipping the function as all labels are 'NA'.")
-        return text
+        return None
 
-    new_label = input(
+    new_label = ask(
         f"Dataset {dataset_number}, enter the target labels for the Tool and Malware (eg., TOOL,MAL): ").strip()
-    default_label = input(
+    default_label = ask(
         f"Dataset {dataset_number}, enter the default label name (eg., TOOL): ").strip()
+    return dataset_labels, new_label, default_label
+
 
-    new_label = new_label.split(',')
+def software_label_update(text, dataset_labels, new_label, default_label):
+    # print("---------------ATT&CK Software Classification------------------\n")
+    lines = text.strip().split("\n")
+    new_label = tuple(new_label.split(','))
+    # One pass handles every selected label; a B token is only continued by tokens with its own label
+    dataset_label_set = frozenset(dataset_labels.split(','))
     updated_dataset = []
+    parsed_lines = parse_lines(lines)
+    next_indices = next_valid_indices(parsed_lines)
+    # Index of the last line consumed by a B walk; an I/E line past it was not part of any walked entity
+    walk_end = -1
+    for i, line in enumerate(lines):
+        # print("initial here", line)
+        if line.split():
+            if parsed_lines[i] is not None:
+                word, bio, label_entity = parsed_lines[i]
+                entity = ''
+                if label_entity in dataset_label_set:
+                    if bio == 'S':
+                        entity += word
+                        software_type = get_type_by_name(entity, default_label, new_label)
+                        # print(entity, software_type)
+                        updated_dataset.append(f"{word} S-{software_type}")
+                    entity_labels = []
+                    if bio == 'B':
+                        entity += word
+                        entity_labels.append(f"B")
+                        # print(entity, bio)
+
+                        j = next_indices[i]
+                        while j is not None:
+                            next_word, next_bio, next_entity = parsed_lines[j]
+                            # print(next_word, next_bio, next_entity)
+                            if next_bio in CONTINUATION_TAGS and next_entity == label_entity:
+                                entity += ' ' + next_word
+                                entity_labels.append(next_bio)
+                                walk_end = j
+                            else:
+                                entity = entity
+                                break
+                            j = next_indices[j]
 
-    for dataset_label in dataset_labels.split(','):
-        temp_dataset = []
-        for i, line in enumerate(lines):
-            # print("initial here", line)
-            if line.split():
-                parts = line.split(" ", 1)
-                if len(parts) == 2:
-                    word, label = parts
-                    entity = ''
-                    if label[2:] == dataset_label:
-                        if label[0] == 'S':
-                            entity += word
-                            software_type = get_type_by_name(entity, default_label, new_label)
-                            # print(entity, software_type)
-                            temp_dataset.append(f"{word} S-{software_type}")
-                        entity_labels = []
-                        if label[0] == 'B':
-                            entity += word
-                            entity_labels.append(f"B")
-                            # print(entity, label[0])
-
-                            next_line = nextLine(lines, i)
-                            while next_line is not None:
-                                next_word, next_label = next_line.split(' ', 1)
-                                # print(next_word, next_label, next_label[0], next_label[2:])
-                                if next_label[0] == 'I' and next_label[2:] == dataset_label:
-                                    entity += ' ' + next_word
-                                    entity_labels.append(f"I")
-                                elif next_label[0] == 'E' and next_label[2:] == dataset_label:
-                                    entity += ' ' + next_word
-                                    entity_labels.append(f"E")
-                                else:
-                                    entity = entity
-                                    break
-                                i += 1
-                                next_line = nextLine(lines, i)
-
-                            software_type = get_type_by_name(entity, default_label, new_label)
-                            # print(entity, software_type, entity_labels)
-                            output = transform_output(entity, software_type, entity_labels)
-                            # print("current output",output)
-                            temp_dataset.append(output)
-                    else:
-                        # print("heya", line)
-                        temp_dataset.append(line)
+                        software_type = get_type_by_name(entity, default_label, new_label)
+                        # print(entity, software_type, entity_labels)
+                        output = transform_output(entity, software_type, entity_labels)
+                        # print("current output",output)
+                        updated_dataset.append(output)
+                    elif bio in CONTINUATION_TAGS and i > walk_end:
+                        # e.g. the E-TOOL of "Fancy B-MAL / APT28 E-TOOL" ends no walk of its own label: keep it
+                        updated_dataset.append(line)
                 else:
-                    temp_dataset.append(line)
-        lines = temp_dataset
-        updated_dataset = lines
+                    # print("heya", line)
+                    updated_dataset.append(line)
+            else:
+                updated_dataset.append(line)
+
     return '\n'.join(updated_dataset)
 
 
-def group_label_update(text, dataset_number):
-    # print("--------------ATT&CK Group Classification-------------------- \n")
-    lines = text.strip().split("\n")
-    updated_dataset = []
-    dataset_labels = input(f"Dataset {dataset_number}, enter the label for group entities to be classified with Mitre "
+def prompt_group_labels(dataset_number):
+    # Returns None when the user skips the classification
+    dataset_labels = ask(f"Dataset {dataset_number}, enter the label for group entities to be classified with Mitre "
                            f"Repos groups, comma-separated if multiple (eg., HackOrg,MAL) or NA to skipp: ").strip()
 
     # Check if all dataset labels are "NA" and skip the function
     if all(label.lower() == 'na' for label in dataset_labels.split(',')):
         print("Skipping the function as all labels are 'NA'.")
-        return text
+        return None
 
-    new_label = input(f"Dataset {dataset_number}, enter the target label name for the group (eg., APT): ").strip()
-    default_label = input(f"Dataset {dataset_number}, enter the default label name (eg., APT): ").strip()
+    new_label = ask(f"Dataset {dataset_number}, enter the target label name for the group (eg., APT): ").strip()
+    default_label = ask(f"Dataset {dataset_number}, enter the default label name (eg., APT): ").strip()
     # dataset_label = 'HackOrg,MAL'
     # default_label = 'Campaign'
     # new_label = 'APT'
+    return dataset_labels, new_label, default_label
 
-    for dataset_label in dataset_labels.split(','):
-        temp_dataset = []
-        for i, line in enumerate(lines):
-            # print("initial here", line)
-            if line.split():
-                parts = line.split(" ", 1)
-                if len(parts) == 2:
-                    word, label = parts
-                    entity = ''
-                    if label[2:] == dataset_label:
-                        if label[0] == 'S':
-                            entity += word
-                            group_type = get_group_by_name(entity, default_label, new_label)
-                            # print(entity, software_type)
-                            temp_dataset.append(f"{word} S-{group_type}")
-                        entity_labels = []
-                        if label[0] == 'B':
-                            entity += word
-                            entity_labels.append(f"B")
-                            # print(entity, label[0])
-
-                            next_line = nextLine(lines, i)
-                            while next_line is not None:
-                                next_word, next_label = next_line.split(' ', 1)
-                                # print(next_word, next_label, next_label[0], next_label[2:])
-                                if next_label[0] == 'I' and next_label[2:] == dataset_label:
-                                    entity += ' ' + next_word
-                                    entity_labels.append(f"I")
-                                elif next_label[0] == 'E' and next_label[2:] == dataset_label:
-                                    entity += ' ' + next_word
-                                    entity_labels.append(f"E")
-                                else:
-                                    entity = entity
-                                    break
-                                i += 1
-                                next_line = nextLine(lines, i)
-
-                            group_type = get_group_by_name(entity, default_label, new_label)
-                            # print(entity, software_type, entity_labels)
-                            output = transform_output(entity, group_type, entity_labels)
-                            # print("current output",output)
-                            temp_dataset.append(output)
-                    else:
-                        # print("heya", line)
-                        temp_dataset.append(line)
+
+def group_label_update(text, dataset_labels, new_label, default_label):
+    # print("--------------ATT&CK Group Classification-------------------- \n")
+    lines = text.strip().split("\n")
+    # One pass handles every selected label; a B token is only continued by tokens with its own label
+    dataset_label_set = frozenset(dataset_labels.split(','))
+    updated_dataset = []
+    parsed_lines = parse_lines(lines)
+    next_indices = next_valid_indices(parsed_lines)
+    # Index of the last line consumed by a B walk; an I/E line past it was not part of any walked entity
+    walk_end = -1
+    for i, line in enumerate(lines):
+        # print("initial here", line)
+        if line.split():
+            if parsed_lines[i] is not None:
+                word, bio, label_entity = parsed_lines[i]
+                entity = ''
+                if label_entity in dataset_label_set:
+                    if bio == 'S':
+                        entity += word
+                        group_type = get_group_by_name(entity, default_label, new_label)
+                        # print(entity, software_type)
+                        updated_dataset.append(f"{word} S-{group_type}")
+                    entity_labels = []
+                    if bio == 'B':
+                        entity += word
+                        entity_labels.append(f"B")
+                        # print(entity, bio)
+
+                        j = next_indices[i]
+                        while j is not None:
+                            next_word, next_bio, next_entity = parsed_lines[j]
+                            # print(next_word, next_bio, next_entity)
+                            if next_bio in CONTINUATION_TAGS and next_entity == label_entity:
+                                entity += ' ' + next_word
+                                entity_labels.append(next_bio)
+                                walk_end = j
+                            else:
+                                entity = entity
+                                break
+                            j = next_indices[j]
+
+                        group_type = get_group_by_name(entity, default_label, new_label)
+                        # print(entity, software_type, entity_labels)
+                        output = transform_output(entity, group_type, entity_labels)
+                        # print("current output",output)
+                        updated_dataset.append(output)
+                    elif bio in CONTINUATION_TAGS and i > walk_end:
+                        # e.g. the E-TOOL of "Fancy B-MAL / APT28 E-TOOL" ends no walk of its own label: keep it
+                        updated_dataset.append(line)
                 else:
-                    temp_dataset.append(line)
-        lines = temp_dataset
-        updated_dataset = lines
+                    # print("heya", line)
+                    updated_dataset.append(line)
+            else:
+                updated_dataset.append(line)
+
     return '\n'.join(updated_dataset)
 
 
+def apply_on_datasets(prompt_labels, transform, done_message):
+    # Ask about both datasets; returns the jobs of the transform on the selected ones and their messages
+    jobs = []
+    done_messages = []
+    for dataset_number in (1, 2):
+        if prompt_user(f"Would you like to apply it on dataset {dataset_number}?"):
+            labels = prompt_labels(dataset_number)
+            if labels is not None:
+                jobs.append((dataset_number, transform, tuple(labels)))
+                done_messages.append(f"{done_message} applied on dataset {dataset_number} \n")
+    return jobs, done_messages
+
+
 def oneToManyMappings(args):
     print("===================== 1-to-many Module====================== \n")
     print("--------------- File Classification: File --> [FILE, SHA1, SHA2, SHA3]------------------\n")
-
-    if prompt_user("Would you like to apply it on Dataset 1?"):
-        with open(args.input_file_1, 'r', encoding='utf-8') as f1:
-            annotated_text_1 = f1.read()
-        annotated_text_1 = classify_file(annotated_text_1, 1)
-        with open(args.input_file_1, 'w', encoding='utf-8') as f1:
-            f1.write(annotated_text_1)
-            print("File classification applied on dataset 1 \n")
-
-    if prompt_user("Would you like to apply it on dataset 2?"):
-        with open(args.input_file_2, 'r', encoding='utf-8') as f2:
-            annotated_text_2 = f2.read()
-        annotated_text_2 = classify_file(annotated_text_2, 2)
-        with open(args.input_file_2, 'w', encoding='utf-8') as f2:
-            f2.write(annotated_text_2)
-            print("File classification applied on dataset 2")
+    file_jobs, file_messages = apply_on_datasets(prompt_file_labels, classify_file, "File classification")
     print('\n')
 
     print(
         "=============== Exploit Classification: Classify exploit into vulnerability name and vulnerability ID "
         "=======\n")
-    if prompt_user("Would you like to apply it on dataset 1?"):
-        with open(args.input_file_1, 'r', encoding='utf-8') as f1:
-            annotated_text_1 = f1.read()
-        annotated_text_1 = classify_exploit(annotated_text_1, 1)
-        with open(args.input_file_1, 'w', encoding='utf-8') as f1:
-            f1.write(annotated_text_1)
-            print("Exploit classification applied on dataset 1")
-        print('\n')
-    if prompt_user("Would you like to apply it on dataset 2?"):
-        with open(args.input_file_2, 'r', encoding='utf-8') as f2:
-            annotated_text_2 = f2.read()
-        annotated_text_2 = classify_exploit(annotated_text_2, 2)
-        with open(args.input_file_2, 'w', encoding='utf-8') as f2:
-            f2.write(annotated_text_2)
-            print("Exploit classification applied on dataset 2")
+    exploit_jobs, exploit_messages = apply_on_datasets(prompt_exploit_labels, classify_exploit,
+                                                       "Exploit classification")
     print('\n')
 
     print("---------------ATT&CK Software Classification: Tool/Malware --> [TOOL, MAL] ---------------\n")
-
-    if prompt_user("Would you like to apply it on dataset 1?"):
-        with open(args.input_file_1, 'r', encoding='utf-8') as f1:
-            annotated_text_1 = f1.read()
-        annotated_text_1 = software_label_update(annotated_text_1, 1)
-        with open(args.input_file_1, 'w', encoding='utf-8') as f1:
-            f1.write(annotated_text_1)
-            print("Software update applied on dataset 1 \n")
-
-    if prompt_user("Would you like to apply it on dataset 2?"):
-        with open(args.input_file_2, 'r', encoding='utf-8') as f2:
-            annotated_text_2 = f2.read()
-        annotated_text_2 = software_label_update(annotated_text_2, 2)
-        with open(args.input_file_2, 'w', encoding='utf-8') as f2:
-            f2.write(annotated_text_2)
-            print("Software update applied on dataset 2 \n")
-
+    software_jobs, software_messages = apply_on_datasets(prompt_software_labels, software_label_update,
+                                                         "Software update")
     print('\n')
-    print("---------------ATT&CK Group Classification: [TOOL, MAL] -> APT------------------\n")
-
-    if prompt_user("Would you like to apply it on dataset 1?"):
-        with open(args.input_file_1, 'r', encoding='utf-8') as f1:
-            annotated_text_1 = f1.read()
-        annotated_text_1 = group_label_update(annotated_text_1, 1)
-        with open(args.input_file_1, 'w', encoding='utf-8') as f1:
-            f1.write(annotated_text_1)
-            print("Group update applied on dataset 1 \n")
 
-    if prompt_user("Would you like to apply it on dataset 2?"):
-        with open(args.input_file_2, 'r', encoding='utf-8') as f2:
-            annotated_text_2 = f2.read()
-        annotated_text_2 = group_label_update(annotated_text_2, 2)
-        with open(args.input_file_2, 'w', encoding='utf-8') as f2:
-            f2.write(annotated_text_2)
-            print("Group update applied on dataset 2 \n")
-        print("oneToManyMappings completed.\n")
+    print("---------------ATT&CK Group Classification: [TOOL, MAL] -> APT------------------\n")
+    group_jobs, group_messages = apply_on_datasets(prompt_group_labels, group_label_update, "Group update")
     print('\n')
+    return (file_jobs + exploit_jobs + software_jobs + group_jobs,
+            file_messages + exploit_messages + software_messages + group_messages + ["oneToManyMappings completed.\n"])
 
 
 # ===================== Discovery of other IoCs=============================================
-def discover_low_iocs(annotated_text, tagging, dataset_number):
+# Patterns used per token by label_low_iocs, compiled once at import. Each one can only match words
+# containing its literal (IP_LITERAL, EMAIL_LITERAL), which is checked first
+IP_LITERAL = '.'
+EMAIL_LITERAL = '@'
+IP_PATTERN = re.compile(r'\b(?:\d{1,3}\.){3}\d{1,3}\b')
+EMAIL_PATTERN = re.compile(r'\b(?:[-a-zA-Z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,})\b')
+
+COMMON_PROTOCOLS = frozenset(['RDP', 'SSH', 'HTTP', 'HTTPS', 'TLS', 'FTP', 'SMTP', 'POP3', 'SFTP', 'IMAP', 'SSL', 'POP',
+                              'UDP', 'TCP', 'IPV4', 'IPV6', 'OPENVPN', 'IPSEC', 'KEBEROS', 'SNMP', 'DTLS', 'SASE',
+                              'TELNET'])
+
+
+def prompt_ioc_labels(dataset_number):
+    # Returns None when the user skips the discovery
     print(f"For the dataset {dataset_number}.")
-    IP = input('Enter the target label for the IP address (eg. IP) or NA to skip: ').strip()
-    URL = input('Enter the target label for the URLs (eg. URL) or NA to skip: ').strip()
-    FILE = input('Enter the target label for any discovered file (eg. FILE) or NA to skip: ').strip()
-    DOM = input('Enter the target label for the DNS (eg. DOM) or NA to skip: ').strip()
-    EMAIL = input('Enter the target label for the email addresses (eg. EMAIL) or NA to skip: ').strip()
-    PROT = input('Enter the target label for the protocols (eg. PROT) or NA to skip: ').strip()
+    IP = ask('Enter the target label for the IP address (eg. IP) or NA to skip: ').strip()
+    URL = ask('Enter the target label for the URLs (eg. URL) or NA to skip: ').strip()
+    FILE = ask('Enter the target label for any discovered file (eg. FILE) or NA to skip: ').strip()
+    DOM = ask('Enter the target label for the DNS (eg. DOM) or NA to skip: ').strip()
+    EMAIL = ask('Enter the target label for the email addresses (eg. EMAIL) or NA to skip: ').strip()
+    PROT = ask('Enter the target label for the protocols (eg. PROT) or NA to skip: ').strip()
     print('\n')
     target_labels = [IP, URL, FILE, DOM, EMAIL, PROT]
     # Check if all dataset labels are "NA" and skip the function
     if all(label.lower() == 'na' for label in target_labels):
         print("Skipping the function as all labels are 'NA'.")
-        return annotated_text
-    default_label = None
-    patterns = [
-        (r'\b(?:\d{1,3}\.){3}\d{1,3}\b', IP),
-        (r'\b(?:[-a-zA-Z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,})\b', EMAIL)
-    ]
+        return None
+    return target_labels
 
-    common_protocols = ['RDP', 'SSH', 'HTTP', 'HTTPS', 'TLS', 'FTP', 'SMTP', 'POP3', 'SFTP', 'IMAP', 'SSL', 'POP',
-                        'UDP', 'TCP', 'IPV4', 'IPV6', 'OPENVPN', 'IPSEC', 'KEBEROS', 'SNMP', 'DTLS', 'SASE', 'TELNET']
 
-    lines = annotated_text.strip().split('\n')
-    replaced_lines = []
+def label_low_iocs(lines, tagging, IP, URL, FILE, DOM, EMAIL, PROT):
+    # Yields the lines with the discovered IoCs labelled, one at a time so that a dataset can be streamed
+    default_label = None
 
     if tagging.upper() == 'BIO':
         tag = 'B'
     elif tagging.upper() == 'BIOES':
         tag = 'S'
 
+    # Output labels are built once, not per token
+    patterns = [
+        (IP_LITERAL, IP_PATTERN, f'{tag}-{IP}'),
+        (EMAIL_LITERAL, EMAIL_PATTERN, f'{tag}-{EMAIL}')
+    ]
+    file_label = f'{tag}-{FILE}'
+    url_label = f'{tag}-{URL}'
+    dom_label = f'{tag}-{DOM}'
+    prot_label = f'{tag}-{PROT}'
+
+    # The label only depends on the word: classify each distinct word once
+    word_labels = {}
     for line in lines:
-        parts = line.split(" ", 1)
-        if len(parts) == 2:
-            word, label = parts
+        word, separator, label = line.partition(" ")
+        if separator:
             # word = re.sub(r'[^\w\s.]+', '', word)
             if label == 'O' and word != '.':
-
-                for pattern, new_label in patterns:
-                    if re.search(pattern, word):
-                        label = f'{tag}-{new_label}'
-                        break
+                if word in word_labels:
+                    label = word_labels[word]
                 else:
-                    # If the loop completes without break, check for URL, domain, or protocol
-                    parsed_url = urlparse(word)
-                    new_label = sampleFile(word, default_label)
-                    if new_label:
-                        if new_label == 'FILE':
-                            label = f'{tag}-{FILE}'
-                        else:
-                            label = f'{tag}-{new_label}'
-                    elif parsed_url.netloc:  # If netloc exists, it's a URL
-                        label = f'{tag}-{URL}'
-                    elif '.' in word and not word.endswith('.'):  # If it contains a dot, it's a domain
-                        label = f'{tag}-{DOM}'
-                    elif word.upper() in common_protocols:  # Check for common protocols
-                        label = f'{tag}-{PROT}'
+                    for literal, pattern, new_label in patterns:
+                        if literal in word and pattern.search(word):
+                            label = new_label
+                            break
                     else:
-                        label = label
-
-                replaced_lines.append(f"{word} {label}")
+                        # If the loop completes without break, check for URL, domain, or protocol
+                        new_label = sampleFile(word, default_label)
+                        if new_label:
+                            if new_label == 'FILE':
+                                label = file_label
+                            else:
+                                label = f'{tag}-{new_label}'
+                        # If netloc exists, it's a URL; urlparse only finds one after a '//'
+                        elif '//' in word and urlparse(word).netloc:
+                            label = url_label
+                        elif '.' in word and word[-1] != '.':  # If it contains a dot, it's a domain
+                            label = dom_label
+                        elif word.upper() in COMMON_PROTOCOLS:  # Check for common protocols
+                            label = prot_label
+                    word_labels[word] = label
+
+                # Most words stay O: reuse their line instead of building an identical one
+                yield line if label == 'O' else f"{word} {label}"
             else:
-                replaced_lines.append(line)
+                yield line
         else:
-            replaced_lines.append(line)
-
-    return '\n'.join(replaced_lines)
+            yield line
 
 
 def discoveryIOCs(args):
     print("This module discovers low-level IoCs (IP, URL, DOM, EMAIL), common protocols found in CTI reports (UDP, "
           "HTTPs, RDP, etc) and files (eg. .exe, .mp4, ect).\n")
 
+    # Only asks the questions; the returned jobs are run by main
+    jobs = []
+    done_messages = []
     if prompt_user("Would you like to apply it on Dataset 1?"):
-        with open(args.input_file_1, 'r', encoding='utf-8') as f1:
-            annotated_text_1 = f1.read()
-        annotated_text_1 = discover_low_iocs(annotated_text_1, args.format_choice, 1)
-        with open(args.input_file_1, 'w', encoding='utf-8') as f1:
-            f1.write(annotated_text_1)
-            print("IoC discovery applied on dataset 1 \n")
+        target_labels = prompt_ioc_labels(1)
+        if target_labels is not None:
+            jobs.append((1, transform_lines, (label_low_iocs, args.format_choice, *target_labels)))
+        done_messages.append("IoC discovery applied on dataset 1 \n")
 
     if prompt_user("Would you like to apply it on Dataset 2?"):
-        with open(args.input_file_2, 'r', encoding='utf-8') as f2:
-            annotated_text_2 = f2.read()
-        annotated_text_2 = discover_low_iocs(annotated_text_2, args.format_choice, 2)
-        with open(args.input_file_2, 'w', encoding='utf-8') as f2:
-            f2.write(annotated_text_2)
-            print("IoC discovery applied on dataset 2 \n")
-        print('discoveryIOCs completed.\n')
+        target_labels = prompt_ioc_labels(2)
+        if target_labels is not None:
+            jobs.append((2, transform_lines, (label_low_iocs, args.format_choice, *target_labels)))
+        done_messages += ["IoC discovery applied on dataset 2 \n", 'discoveryIOCs completed.\n']
+
+    return jobs, done_messages
 
 
 # ===================================== Discovery of Encryption Algorithms=======================
-def get_encryption_by_name(name, default_label, new_label):
-    name = name.lower()
+@lru_cache(maxsize=None)
+def load_encryption_names():
+    # lowercased encryption algorithm names, read once per run
     file_path = "encryption_algorithms.csv"
-    df = pd.read_csv(file_path)
-
-    row = df[df['ENCR_Algorithms'].str.lower() == name]
-    if not row.empty:
-        return new_label
-    else:
-        return default_label
+    with open(file_path, newline='', encoding='utf-8') as f:
+        return frozenset(row['ENCR_Algorithms'].lower() for row in csv.DictReader(f) if row['ENCR_Algorithms'])
 
 
-def discover_encr(text, tagging, dataset_number):
-    lines = text.strip().split("\n")
+def prompt_encryption_label(dataset_number):
+    # Returns None when the user skips the discovery
     print(f"For Dataset {dataset_number}")
-    new_label = input(
+    new_label = ask(
         "Enter the label for all discovered encryption entities in the dataset (eg. ENCR) or NA to skip: ").strip()
 
     # Check if all dataset labels are "NA" and skip the function
     if new_label.lower() == 'na' or len(new_label.split(',')) > 1:
         print("Skipping the function as label is 'NA' and/or len(new_label.split(',')) > 1.")
-        return text
+        return None
+    return new_label
 
-    default_label = 'O'
+
+def label_encryption(lines, tagging, new_label):
+    # Yields the lines with the discovered encryption algorithms labelled, one at a time so that a dataset
+    # can be streamed
 
     # print(new_label)
 
@@ -854,101 +918,89 @@ def discover_encr(text, tagging, dataset_number):
     elif tagging == 'BIOES':
         tag = 'S'
 
-    updated_dataset = []
-    for i, line in enumerate(lines):
+    encryption_names = load_encryption_names()
+    for line in lines:
         if line.split():
-            parts = line.split(" ", 1)
-            if len(parts) == 2:
-                word, label = parts
+            word, separator, label = line.partition(" ")
+            if separator:
                 if label.startswith('O'):
-                    new_label2 = get_encryption_by_name(word, default_label, new_label)
-                    # print(new_label2)
-                    if new_label2 != default_label:
-                        updated_dataset.append(f"{word} {tag}-{new_label2}")
+                    if word.lower() in encryption_names:
+                        yield f"{word} {tag}-{new_label}"
                     else:
-                        updated_dataset.append(f"{word} {label}")
+                        yield line
 
                 else:
-                    updated_dataset.append(line)
+                    yield line
             else:
-                updated_dataset.append(line)
-
-    return '\n'.join(updated_dataset)
+                yield line
 
 
 def discover_encry_algorithms(args):
     print("This module discovers common encryption algorithms (3DES, AES, SHA1, base64, RSA, etc ) found in CTI "
           "reports.\n")
+    # Only asks the questions; the returned jobs are run by main
+    jobs = []
+    done_messages = []
     if prompt_user("Would you like to apply it on Dataset 1?"):
-        with open(args.input_file_1, 'r', encoding='utf-8') as f1:
-            annotated_text_1 = f1.read()
-        annotated_text_1 = discover_encr(annotated_text_1, args.format_choice, 1)
-        with open(args.input_file_1, 'w', encoding='utf-8') as f1:
-            f1.write(annotated_text_1)
-            print('discovery of encryption algorithms applied on dataset1.\n')
+        new_label = prompt_encryption_label(1)
+        if new_label is not None:
+            jobs.append((1, transform_lines, (label_encryption, args.format_choice, new_label)))
+        done_messages.append('discovery of encryption algorithms applied on dataset1.\n')
 
     if prompt_user("Would you like to apply it on Dataset 2?"):
-        with open(args.input_file_2, 'r', encoding='utf-8') as f2:
-            annotated_text_2 = f2.read()
-        annotated_text_2 = discover_encr(annotated_text_2, args.format_choice, 2)
-        with open(args.input_file_2, 'w', encoding='utf-8') as f2:
-            f2.write(annotated_text_2)
-            print('discovery of encryption algorithms applied on dataset2.\n')
-        print('discover_encry_algorithms completed.\n')
+        new_label = prompt_encryption_label(2)
+        if new_label is not None:
+            jobs.append((2, transform_lines, (label_encryption, args.format_choice, new_label)))
+        done_messages += ['discovery of encryption algorithms applied on dataset2.\n',
+                          'discover_encry_algorithms completed.\n']
+
+    return jobs, done_messages
 
 
 # =================================== Discover Operating Systems=================================
 
 def transform_OS_output(entity, tagging, label_name):
-    transformed_output = []
+    words = entity.split()
+    # Works for entities of any length
     if tagging == 'BIOES':
-        if len(entity.split()) == 1:
+        if len(words) == 1:
             entity_labels = ['S']
-        if len(entity.split()) == 2:
-            entity_labels = ['B', 'E']
-        if len(entity.split()) == 3:
-            entity_labels = ['B', 'I', 'E']
-        if len(entity.split()) == 4:
-            entity_labels = ['B', 'I', 'I', 'E']
-        if len(entity.split()) == 5:
-            entity_labels = ['B', 'I', 'I', 'I', 'E']
+        else:
+            entity_labels = ['B'] + ['I'] * (len(words) - 2) + ['E']
     if tagging == 'BIO':
-        if len(entity.split()) == 1:
-            entity_labels = ['B']
-        if len(entity.split()) == 2:
-            entity_labels = ['B', 'I']
-        if len(entity.split()) == 3:
-            entity_labels = ['B', 'I', 'I']
-        if len(entity.split()) == 4:
-            entity_labels = ['B', 'I', 'I', 'I']
-        if len(entity.split()) == 5:
-            entity_labels = ['B', 'I', 'I', 'I', 'I']
-
-    for word, tag in zip(entity.split(), entity_labels):
-        transformed_output.append(f"{word} {tag}-{label_name}")
+        entity_labels = ['B'] + ['I'] * (len(words) - 1)
 
-    return "\n".join(transformed_output)
+    suffix = '-' + label_name
+    return "\n".join(f"{word} {tag}{suffix}" for word, tag in zip(words, entity_labels))
 
 
-def get_os_by_name(name):
-    name = name.lower()
+# Lowercased first words of the operating system names; only these tokens start an OS entity
+OS_NAME_STARTS = frozenset(['windows', 'linux', 'mac', 'macos', 'ubuntu', 'fedora', 'centos', 'rhel', 'freebsd'])
+
+
+@lru_cache(maxsize=None)
+def load_os_names():
+    # lowercased operating system names, read once per run
     file_path = "operating_systems.csv"
-    df = pd.read_csv(file_path)
+    with open(file_path, newline='', encoding='utf-8') as f:
+        return frozenset(row['Operating_systems'].lower() for row in csv.DictReader(f) if row['Operating_systems'])
 
-    row = df[df['Operating_systems'].str.lower() == name]
-    if not row.empty:
-        return True
-    else:
-        return False
 
+def get_os_by_name(lower_name):
+    # The name must already be lowercased
+    return lower_name in load_os_names()
 
-def discover_os(text, tagging, dataset_number):
+
+def prompt_os_label(dataset_number):
+    print(f"For Dataset {dataset_number}:")
+    return ask("Enter the label name for the operating system (eg. OS): ")
+
+
+def label_operating_systems(text, tagging, new_label):
     lines = text.strip().split("\n")
+    parsed_lines = parse_lines(lines)
+    next_indices = next_valid_indices(parsed_lines)
     updated_dataset = []
-    print(f"For Dataset {dataset_number}:")
-    new_label = input("Enter the label name for the operating system (eg. OS): ")
-    startWith = ['windows', 'linux', 'mac', 'macos' 'Ubuntu', 'fedora', 'centos', 'RHEL', 'FreeBSD']
-    startWith = [l.lower() for l in startWith]
 
     # new_label = 'OS'
     current_entity = ''
@@ -959,33 +1011,35 @@ def discover_os(text, tagging, dataset_number):
     for i, line in enumerate(lines):
         # print("initial here", line)
         if line.split():
-            parts = line.split(" ", 1)
-            if len(parts) == 2:
-                word, label = parts
+            word, separator, label = line.partition(" ")
+            if separator:
                 entity = ''
                 if label == 'O':
-                    if word.lower() == 'android':
+                    # Lowercase each token once; the entity is also kept lowercased for the lookups
+                    lower_word = word.lower()
+                    if lower_word == 'android':
                         # entity += word
                         updated_dataset.append(f"{word} {tag}-{new_label}")
 
                     # check neiboring words
-                    elif word.lower() in startWith:
+                    elif lower_word in OS_NAME_STARTS:
                         entity += word
+                        lower_entity = lower_word
 
-                        next_line = nextLine(lines, i)
-                        while next_line is not None:
-                            next_word, next_label = next_line.split(' ', 1)
-                            if next_label[0] == 'O':
+                        j = next_indices[i]
+                        while j is not None:
+                            next_word, next_bio, next_entity = parsed_lines[j]
+                            if next_bio == 'O':
                                 current_entity = entity
                                 entity += ' ' + next_word
+                                lower_entity += ' ' + next_word.lower()
 
                             else:
                                 entity = entity
                                 break
                             # if entity.lower() in OS:
-                            if get_os_by_name(entity.lower()):
-                                i += 1
-                                next_line = nextLine(lines, i)
+                            if get_os_by_name(lower_entity):
+                                j = next_indices[j]
                             else:
                                 entity = current_entity
                                 break
@@ -996,7 +1050,7 @@ def discover_os(text, tagging, dataset_number):
                     elif word in current_entity.split(' '):
                         continue
                     else:
-                        updated_dataset.append(f"{word} {label}")
+                        updated_dataset.append(line)
                 else:
                     updated_dataset.append(line)
             else:
@@ -1007,112 +1061,121 @@ def discover_os(text, tagging, dataset_number):
 
 def discover_operating_systems(args):
     print("This module discovers common OS (Linux, Windows, Mac, etc ) found in CTI reports.\n")
+    # Only asks the questions; the returned jobs are run by main
+    jobs = []
+    done_messages = []
     if prompt_user("Would you like to apply it on Dataset 1?"):
-        with open(args.input_file_1, 'r', encoding='utf-8') as f1:
-            annotated_text_1 = f1.read()
-        annotated_text_1 = discover_os(annotated_text_1, args.format_choice, 1)
-        with open(args.input_file_1, 'w', encoding='utf-8') as f1:
-            f1.write(annotated_text_1)
-            print('discovery OS applied on dataset1.\n')
+        new_label = prompt_os_label(1)
+        jobs.append((1, label_operating_systems, (args.format_choice, new_label)))
+        done_messages.append('discovery OS applied on dataset1.\n')
 
     if prompt_user("Would you like to apply it on Dataset 2?"):
-        with open(args.input_file_2, 'r', encoding='utf-8') as f2:
-            annotated_text_2 = f2.read()
-        annotated_text_2 = discover_os(annotated_text_2, args.format_choice, 2)
-        with open(args.input_file_2, 'w', encoding='utf-8') as f2:
-            f2.write(annotated_text_2)
-            print('discovery OS applied on dataset2.\n')
-        print('discover_operating_systems completed.\n')
+        new_label = prompt_os_label(2)
+        jobs.append((2, label_operating_systems, (args.format_choice, new_label)))
+        done_messages += ['discovery OS applied on dataset2.\n', 'discover_operating_systems completed.\n']
+
+    return jobs, done_messages
 
 
 # ================================ Fix mislabelling issues in the datasets for single entities =======================
 
+def assign_entity_label(entity_labels, pending, corrected_lines, word, label):
+    # The first S-/B- label seen for a word wins: record it and patch the word's earlier O lines.
+    # Returns the label the current token gets
+    entity_label = entity_labels.get(word)
+    if entity_label is not None:
+        return entity_label
+    entity_labels[word] = label
+    for j in pending.pop(word, ()):
+        corrected_lines[j] = f"{word} {label}"
+    return label
+
+
 def correct_mislabeling(text, dataset_number):
     print(f"Fixing mislabeling issues on dataset {dataset_number}...")
     lines = text.strip().split("\n")
     entity_labels = {}
+    # word -> indices of its O lines seen before the word got an entity label, patched once it does
+    pending = {}
 
-    temp_lines = []
+    corrected_lines = []
+    # A B- token is only relabelled when the next labelled token is O, which is known once that token is read
+    open_b = None
     for i, line in enumerate(lines):
-        parts = line.split(" ", 1)
-        if len(parts) == 2:
-            word, label = parts
-            if label.startswith('S-'):
-                if word in entity_labels:
-                    label = entity_labels[word]
+        word, separator, label = line.partition(" ")
+        if separator:
+            if open_b is not None:
+                if label[:1] == 'O':
+                    b_index, b_word, b_label = open_b
+                    b_label = assign_entity_label(entity_labels, pending, corrected_lines, b_word, b_label)
+                    corrected_lines[b_index] = f"{b_word} {b_label}"
+                open_b = None
+
+            new_label = label
+            if label == 'O':
+                entity_label = entity_labels.get(word)
+                if entity_label is not None:
+                    new_label = entity_label
                 else:
-                    entity_labels[word] = label
-                temp_lines.append(f"{word} {label}")
+                    pending.setdefault(word, []).append(i)
+            elif label.startswith('S-'):
+                new_label = assign_entity_label(entity_labels, pending, corrected_lines, word, label)
             elif label.startswith('B-'):
-                next_line = nextLine(lines, i)
-                if next_line and next_line.split(' ', 1)[1].startswith('O'):
-                    if word in entity_labels:
-                        label = entity_labels[word]
-                    else:
-                        entity_labels[word] = label
-                    temp_lines.append(f"{word} {label}")
-                else:
-                    temp_lines.append(f"{word} {label}")
-            else:
-                temp_lines.append(f"{word} {label}")
-        else:
-            temp_lines.append(line)
-    # print(entity_labels)
-    lines = temp_lines
-
-    corrected_lines = []
-    for line in lines:
-        parts = line.split(" ", 1)
-        if len(parts) == 2:
-            word, label = parts
-            if label == 'O' and word in entity_labels:
-                corrected_lines.append(f"{word} {entity_labels[word]}")
-            else:
-                corrected_lines.append(line)
+                open_b = (i, word, label)
+            # Unchanged tokens keep their original line
+            corrected_lines.append(line if new_label == label else f"{word} {new_label}")
         else:
             corrected_lines.append(line)
+    # print(entity_labels)
 
     return '\n'.join(corrected_lines)
 
 
 def fixingMislabeledIssue(args):
     print("This module fixes inconsistent labeling issues in the datasets.\n")
+    # Only asks the questions; the returned jobs are run by main
+    jobs = []
+    done_messages = []
     if prompt_user("Would you like to apply it on Dataset 1?"):
-        with open(args.input_file_1, 'r', encoding='utf-8') as f1:
-            annotated_text_1 = f1.read()
-        annotated_text_1 = correct_mislabeling(annotated_text_1, 1)
-        with open(args.input_file_1, 'w', encoding='utf-8') as f1:
-            f1.write(annotated_text_1)
-            print("fixingMislabeledIssue applied on dataset 1.\n")
+        jobs.append((1, correct_mislabeling, (1,)))
+        done_messages.append("fixingMislabeledIssue applied on dataset 1.\n")
 
     if prompt_user("Would you like to apply it on Dataset 2?"):
-        with open(args.input_file_2, 'r', encoding='utf-8') as f2:
-            annotated_text_2 = f2.read()
-        annotated_text_2 = correct_mislabeling(annotated_text_2, 2)
-        with open(args.input_file_2, 'w', encoding='utf-8') as f2:
-            f2.write(annotated_text_2)
-            print("fixingMislabeledIssue aaplied on dataset 2.\n")
-        print("fixingMislabeledIssue completed.\n")
+        jobs.append((2, correct_mislabeling, (2,)))
+        done_messages += ["fixingMislabeledIssue aaplied on dataset 2.\n", "fixingMislabeledIssue completed.\n"]
+
+    return jobs, done_messages
 
 
 def merge_datasets(dataset1_path, dataset2_path, merged_output_path):
-    with open(dataset1_path, 'r', encoding='utf-8') as f1:
-        dataset1_content = f1.read()
+    # Copy both datasets chunk by chunk, separated by a newline, without holding either of them in memory
+    with open(merged_output_path, 'w', encoding='utf-8', buffering=IO_BUFFER_SIZE) as merged_file:
+        with open(dataset1_path, 'r', encoding='utf-8', buffering=IO_BUFFER_SIZE) as f1:
+            shutil.copyfileobj(f1, merged_file, IO_BUFFER_SIZE)
+        merged_file.write('\n')
+        with open(dataset2_path, 'r', encoding='utf-8', buffering=IO_BUFFER_SIZE) as f2:
+            shutil.copyfileobj(f2, merged_file, IO_BUFFER_SIZE)
 
-    with open(dataset2_path, 'r', encoding='utf-8') as f2:
-        dataset2_content = f2.read()
 
-    # Perform any additional processing or merging logic if needed
-    merged_content = dataset1_content + '\n' + dataset2_content
+# ======================= Execution=================================
+# Answers replayed from a --plan file, and every answer given during this run
+PLAN = {'replay': [], 'answers': []}
 
-    with open(merged_output_path, 'w', encoding='utf-8') as merged_file:
-        merged_file.write(merged_content)
+
+def ask(message):
+    # All the questions go through here: the answer comes from the plan while it lasts, otherwise from the user
+    if PLAN['replay']:
+        answer = PLAN['replay'].pop(0)
+        print(f"{message}{answer}")
+    else:
+        answer = input(message)
+    PLAN['answers'].append(answer)
+    return answer
 
 
-# ======================= Execution=================================
 def prompt_user(message):
     while True:
-        response = input(f"{message} (y/n): ").strip().lower()
+        response = ask(f"{message} (y/n): ").strip().lower()
         if response in ['y', 'n']:
             return response == 'y'
 
@@ -1123,13 +1186,23 @@ def main():
     parser.add_argument('input_file_1', help='Path to the first input file')
     parser.add_argument('input_file_2', help='Path to the second input file')
     parser.add_argument('merged_output_file', help='Path to the merged output file')
+    parser.add_argument('--plan', help='JSON file with the answers to all the questions; it is written after an '
+                                       'interactive run when it does not exist yet')
     args = parser.parse_args()
 
-    with open(args.input_file_1, 'r', encoding='utf-8') as f1:
+    if args.plan and os.path.exists(args.plan):
+        with open(args.plan, 'r', encoding='utf-8') as plan_file:
+            PLAN['replay'] = json.load(plan_file)
+
+    # What is on disk, when reading did not translate any line ending: a dataset that comes out of the
+    # conversion and the modules unchanged does not need to be written back
+    with open(args.input_file_1, 'r', encoding='utf-8', buffering=IO_BUFFER_SIZE) as f1:
         annotated_text_1 = f1.read()
+        disk_text_1 = annotated_text_1 if f1.newlines in (None, '\n') else None
 
-    with open(args.input_file_2, 'r', encoding='utf-8') as f2:
+    with open(args.input_file_2, 'r', encoding='utf-8', buffering=IO_BUFFER_SIZE) as f2:
         annotated_text_2 = f2.read()
+        disk_text_2 = annotated_text_2 if f2.newlines in (None, '\n') else None
     #
     format_1 = detect_format(annotated_text_1)
     format_2 = detect_format(annotated_text_2)
@@ -1154,39 +1227,51 @@ def main():
     else:
         raise ValueError("Invalid format choice. Use 'BIO' or 'BIOES'.")
 
-    with open(args.input_file_1, 'w', encoding='utf-8') as f1:
-        f1.write(annotated_text_1)
-
-    with open(args.input_file_2, 'w', encoding='utf-8') as f2:
-        f2.write(annotated_text_2)
-
     createTables()
     # ============================================================================
     print("Integration of two TI NER datasets in cyber-security")
 
-    if prompt_user("Do you want to execute oneTo1Mappings?"):
-        oneTo1Mappings(args)
-
-    if prompt_user("Do you want to execute manyTo1Mappings?"):
-        manyTo1Mappings(args)
-
-    if prompt_user("Do you want to execute oneToManyMappings?"):
-        oneToManyMappings(args)
-
-    if prompt_user("Do you want to execute discoveryIOCs?"):
-        discoveryIOCs(args)
-
-    if prompt_user("Do you want to execute discover_encry_algorithms?"):
-        discover_encry_algorithms(args)
-
-    if prompt_user("Do you want to execute discover_operating_systems?"):
-        discover_operating_systems(args)
+    # All the questions are asked first; the modules then run without interruption
+    modules = [
+        ("Do you want to execute oneTo1Mappings?", oneTo1Mappings),
+        ("Do you want to execute manyTo1Mappings?", manyTo1Mappings),
+        ("Do you want to execute oneToManyMappings?", oneToManyMappings),
+        ("Do you want to execute discoveryIOCs?", discoveryIOCs),
+        ("Do you want to execute discover_encry_algorithms?", discover_encry_algorithms),
+        ("Do you want to execute discover_operating_systems?", discover_operating_systems),
+        # ("Do you want to execute fixingMislabeledIssue?", fixingMislabeledIssue),
+    ]
+    steps = {1: [], 2: []}
+    done_messages = []
+    for message, module in modules:
+        if prompt_user(message):
+            module_jobs, module_messages = module(args)
+            for dataset_number, transform, transform_args in module_jobs:
+                steps[dataset_number].append((transform, transform_args))
+            done_messages += module_messages
+    merge = prompt_user("Do you want to execute merge_datasets?")
+
+    if args.plan and not os.path.exists(args.plan):
+        with open(args.plan, 'w', encoding='utf-8') as plan_file:
+            json.dump(PLAN['answers'], plan_file)
+
+    # Each dataset goes through all of its steps in its own worker, in memory, and is written back once
+    jobs = [(dataset_number, run_pipeline, (steps[dataset_number],)) for dataset_number in (1, 2)
+            if steps[dataset_number]]
+    annotated_text_1, annotated_text_2 = run_on_datasets([annotated_text_1, annotated_text_2], jobs)
+    for message in done_messages:
+        print(message)
+
+    if annotated_text_1 != disk_text_1:
+        with open(args.input_file_1, 'w', encoding='utf-8', buffering=IO_BUFFER_SIZE) as f1:
+            f1.write(annotated_text_1)
 
-    # if prompt_user("Do you want to execute fixingMislabeledIssue?"):
-    #     fixingMislabeledIssue(args)
+    if annotated_text_2 != disk_text_2:
+        with open(args.input_file_2, 'w', encoding='utf-8', buffering=IO_BUFFER_SIZE) as f2:
+            f2.write(annotated_text_2)
 
     # Merge datasets at the end
-    if prompt_user("Do you want to execute merge_datasets?"):
+    if merge:
         merge_datasets(args.input_file_1, args.input_file_2, args.merged_output_file)
         print("Both datasets merged successfully.")
 